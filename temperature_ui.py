@@ -5,16 +5,16 @@ LoRa Transceiver UI
 A PyQt6-based GUI for monitoring and controlling Wio-E5 LoRa modules
 """
 
+import queue
+import re
 import sys
 import time
 import serial
-import threading
-from datetime import datetime
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                            QHBoxLayout, QLabel, QPushButton, QTextEdit, 
+                            QHBoxLayout, QLabel, QPushButton, QPlainTextEdit, 
                             QGridLayout, QGroupBox, QFrame, QSplitter)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, pyqtSlot
-from PyQt6.QtGui import QFont, QColor, QTextCursor
+from PyQt6.QtCore import Qt, QMutex, QMutexLocker, QThread, QTimer, pyqtSignal
+from PyQt6.QtGui import QFont
 
 # LoRa module configuration
 LORA_PARAMS = {
@@ -27,11 +27,45 @@ LORA_PARAMS = {
     "crc": "ON"
 }
 
+# RF configuration command, built once from LORA_PARAMS
+_RFCFG_BYTES = (
+    f'AT+TEST=RFCFG,{LORA_PARAMS["frequency"]},{LORA_PARAMS["spreading_factor"]},'
+    f'{LORA_PARAMS["bandwidth"]},{LORA_PARAMS["coding_rate"]},{LORA_PARAMS["power"]},'
+    f'{LORA_PARAMS["preamble"]},{LORA_PARAMS["crc"]}\r\n'
+).encode('ascii')
+
+# Configuration sequences sent on connect, as (command, status message) pairs
+_CONFIG_TX = (
+    (b'AT+MODE=TEST\r\n', "Set TEST mode"),
+    (_RFCFG_BYTES, "Configured LoRa parameters"),
+)
+# The receiver additionally enables continuous receive
+_CONFIG_RX = _CONFIG_TX + (
+    (b'AT+TEST=RXLRPKT\r\n', "Started listening for packets"),
+)
+
+# Transmit command framing and hex payload detection
+_TX_PREFIX = b'AT+TEST=TXLRPKT,"'
+_TX_SUFFIX = b'"\r\n'
+_HEX_RE = re.compile(r'[0-9A-Fa-f]+')
+
+# Temperature reply, e.g. "+TEST: TEMP, 25.30" or "+TEST: TEMP 25.30"
+_TEMP_RE = re.compile(r'TEMP[,: ]+(-?[0-9]+(?:\.[0-9]+)?)')
+
+# Hex payload of a received LoRa packet, matched on the raw serial bytes
+_RX_RE = re.compile(rb'\+TEST: RX "([0-9A-Fa-f]+)"')
+
 # Serial port settings
 TRANSMITTER_PORT = '/dev/cu.usbserial-10'
 RECEIVER_PORT = '/dev/cu.usbserial-1120'
 BAUD_RATE = 9600
-TIMEOUT = 1
+TIMEOUT = 0.05  # short read timeout; the run loop blocks on the port instead of sleeping
+
+# Longest line buffered before it is handed on without a terminator
+MAX_LINE_BYTES = 4096
+
+# Log widgets drop their oldest lines beyond this many
+LOG_MAX_LINES = 2000
 
 
 class SerialWorker(QThread):
@@ -39,6 +73,7 @@ class SerialWorker(QThread):
     status_update = pyqtSignal(str, str)  # device, message
     message_received = pyqtSignal(str, str)  # device, message
     connection_status = pyqtSignal(str, bool)  # device, status
+    temperature_ready = pyqtSignal(object)  # temperature in °C, or None on failure
 
     def __init__(self, port, device_type):
         super().__init__()
@@ -47,28 +82,26 @@ class SerialWorker(QThread):
         self.running = False
         self.serial = None
         self.message_to_send = None
+        self.tx_command = None
+        self._tx_mutex = QMutex()  # keeps message_to_send and tx_command in step across threads
         self.send_interval = 5  # seconds
         self.last_send_time = 0
+        self._cmd_q = queue.Queue()  # commands to run on the worker thread
+        self._rx_buf = bytearray()  # bytes received but not yet split into lines
+        self._temp_cache = (None, 0.0)  # last temperature read and when it was taken
+        self._temp_ttl = 2.0  # seconds a cached temperature stays valid
+        self.verbose = False  # include debug detail in status updates
 
     def configure_device(self):
         """Send AT commands to configure the LoRa module"""
         try:
-            # Set TEST mode
-            self.serial.write(b'AT+MODE=TEST\r\n')
-            time.sleep(0.5)
-            self.status_update.emit(self.device_type, f"Set TEST mode")
-            
-            # Configure RF parameters
-            rf_config = f'AT+TEST=RFCFG,{LORA_PARAMS["frequency"]},{LORA_PARAMS["spreading_factor"]},{LORA_PARAMS["bandwidth"]},{LORA_PARAMS["coding_rate"]},{LORA_PARAMS["power"]},{LORA_PARAMS["preamble"]},{LORA_PARAMS["crc"]}\r\n'
-            self.serial.write(rf_config.encode())
-            time.sleep(0.5)
-            self.status_update.emit(self.device_type, f"Configured LoRa parameters")
-            
-            # For receiver, enable continuous receive
-            if self.device_type == "Receiver":
-                self.serial.write(b'AT+TEST=RXLRPKT\r\n')
-                time.sleep(0.5)
-                self.status_update.emit(self.device_type, f"Started listening for packets")
+            commands = _CONFIG_RX if self.device_type == "Receiver" else _CONFIG_TX
+            for command, status in commands:
+                self.serial.write(command)
+                if not self._wait_for_ok(1.0):
+                    self.status_update.emit(self.device_type, f"No acknowledgement for {command!r}")
+                    return False
+                self.status_update.emit(self.device_type, status)
                 
             return True
         except Exception as e:
@@ -94,95 +127,151 @@ class SerialWorker(QThread):
             self.status_update.emit(self.device_type, f"Disconnected")
             self.connection_status.emit(self.device_type, False)
 
+    def _read_line(self):
+        """Return the next CRLF-terminated line from the port, or None on timeout
+
+        Reads whatever is waiting in one call and keeps any bytes past the line
+        ending for the next call, so several responses arriving in one USB
+        packet, or one response split across packets, are handled alike.
+        """
+        while True:
+            end = self._rx_buf.find(b'\r\n')
+            if end >= 0:
+                line = bytes(self._rx_buf[:end])
+                del self._rx_buf[:end + 2]
+                return line
+            if len(self._rx_buf) >= MAX_LINE_BYTES:
+                line = bytes(self._rx_buf)
+                self._rx_buf.clear()
+                return line
+            chunk = self.serial.read(self.serial.in_waiting or 1)
+            if not chunk:
+                return None
+            self._rx_buf += chunk
+
+    def _wait_for_ok(self, timeout):
+        """Wait for the module to answer the last AT command
+
+        The Wio-E5 acknowledges most commands with a "+..." echo line rather
+        than a bare OK, so either counts as success. Returns False on ERROR or
+        if nothing arrives within timeout seconds; the caller reports which
+        command failed and must not carry on as if it had been applied.
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            raw = self._read_line()
+            line = raw.decode('ascii', errors='ignore').strip() if raw else ''
+            if not line:
+                continue
+                
+            self.status_update.emit(self.device_type, f"Received: {line}")
+            if "ERROR" in line:
+                return False
+            if line == "OK" or line.startswith("+"):
+                return True
+                
+        return False
+
     def send_message(self, message):
         """Prepare a message to be sent"""
-        self.message_to_send = message
+        # Convert to hex if it's not already, once per queued message
+        if _HEX_RE.fullmatch(message):
+            hex_message = message
+        else:
+            hex_message = message.encode('ascii', errors='replace').hex().upper()
+        tx_command = _TX_PREFIX + hex_message.encode('ascii') + _TX_SUFFIX
+        with QMutexLocker(self._tx_mutex):
+            self.tx_command = tx_command
+            self.message_to_send = message
         self.status_update.emit(self.device_type, f"Queued message for sending: {message}")
 
+    def request_temperature(self):
+        """Queue a temperature read to be performed on the worker thread"""
+        self._cmd_q.put('read_temp')
+
     def read_temperature(self):
         """Read temperature from the Wio-E5 internal sensor"""
         if not self.serial or not self.serial.is_open:
             self.status_update.emit(self.device_type, "Error: Device not connected")
             return None
             
+        # The internal sensor changes slowly, so reuse a recent reading
+        cached_value, cached_time = self._temp_cache
+        if cached_value is not None and time.time() - cached_time < self._temp_ttl:
+            self.status_update.emit(self.device_type, f"Using cached temperature: {cached_value}°C")
+            return cached_value
+            
+        # Collected and emitted as one status update to keep cross-thread signal traffic low
+        events = []
         try:
             # Flush all buffers to ensure clean state
             self.serial.reset_input_buffer()
             self.serial.reset_output_buffer()
+            self._rx_buf.clear()
             
-            # Show debug message
-            self.status_update.emit(self.device_type, "Sending temperature read command...")
+            if self.verbose:
+                events.append("Sending temperature read command...")
             
             # Send temperature read command
             self.serial.write(b'AT+TEST=TEMP\r\n')
             
-            # Important: Wait for device to process the command
-            time.sleep(0.5)
+            # Short per-read timeout so each read returns as soon as the
+            # device goes quiet; the overall read is bounded by the deadline
+            previous_timeout = self.serial.timeout
+            self.serial.timeout = 0.2
             
-            # Wait for response with longer timeout
-            start_time = time.time()
-            response = ""
+            deadline = time.time() + 5
+            response_lines = []
             complete_response = False
             temperature_value = None
             
-            # Use a longer timeout - 5 seconds
-            while time.time() - start_time < 5 and not complete_response:
-                if self.serial.in_waiting:
-                    line = self.serial.readline().decode('ascii', errors='ignore').strip()
+            try:
+                while time.time() < deadline and not complete_response:
+                    raw = self._read_line()
+                    line = raw.decode('ascii', errors='ignore').strip() if raw else ''
                     
-                    # Skip empty lines
+                    # Skip empty lines (read timed out or blank line)
                     if not line:
                         continue
                         
                     # Add line to cumulative response with indicator
-                    response += "RAW> " + line + "\n"
-                    self.status_update.emit(self.device_type, f"Response line: '{line}'")
+                    response_lines.append("RAW> " + line)
                     
                     # Check for OK or ERROR to mark completion
                     if line == "OK" or "ERROR" in line:
                         complete_response = True
                     
                     # Check if we have a temperature response
-                    if "TEMP" in line:
-                        self.status_update.emit(self.device_type, f"Found temperature data: '{line}'")
-                        # Try to extract temperature - may be in different formats
-                        try:
-                            # Try different parsing approaches
-                            if "TEMP," in line:
-                                temp_part = line.split("TEMP,")[1].strip()
-                                temperature_value = float(temp_part)
-                            elif ":" in line and "TEMP" in line:
-                                # Try alternative format "+TEST: TEMP XX.XX"
-                                parts = line.split()
-                                for i, part in enumerate(parts):
-                                    if part == "TEMP" and i < len(parts) - 1:
-                                        temperature_value = float(parts[i+1])
-                                        break
-                                        
-                            self.status_update.emit(self.device_type, f"Parsed temperature: {temperature_value}°C")
-                        except (IndexError, ValueError) as e:
-                            self.status_update.emit(self.device_type, f"Parse error: {str(e)} in '{line}'")
-                
-                # Small delay between reads
-                time.sleep(0.1)
+                    match = _TEMP_RE.search(line)
+                    if match:
+                        temperature_value = float(match.group(1))
+                        # Only the trailing OK is left; read it so the run loop
+                        # doesn't log it separately, but don't wait long for it
+                        deadline = min(deadline, time.time() + 0.3)
+            finally:
+                self.serial.timeout = previous_timeout
                 
             # Log the complete response regardless of success
-            self.status_update.emit(self.device_type, f"Complete response:\n{response}")
+            events.append("Complete response:\n" + "\n".join(response_lines))
             
             # Check if we found a temperature value
             if temperature_value is not None:
-                self.status_update.emit(self.device_type, f"Final temperature: {temperature_value}°C")
+                events.append(f"Final temperature: {temperature_value}°C")
+                self._temp_cache = (temperature_value, time.time())
                 return temperature_value
             else:
                 if complete_response:
-                    self.status_update.emit(self.device_type, "Temperature data not found in response")
+                    events.append("Temperature data not found in response")
                 else:
-                    self.status_update.emit(self.device_type, "Timeout waiting for complete response")
+                    events.append("Timeout waiting for complete response")
                 return None
             
         except Exception as e:
-            self.status_update.emit(self.device_type, f"Temperature reading error: {str(e)}")
+            events.append(f"Temperature reading error: {str(e)}")
             return None
+            
+        finally:
+            self.status_update.emit(self.device_type, "\n".join(events))
 
     def run(self):
         """Main thread loop"""
@@ -199,39 +288,41 @@ class SerialWorker(QThread):
         
         while self.running:
             try:
-                # Handle receive for both transmitter and receiver (for response reading)
-                if self.serial.in_waiting:
-                    response = self.serial.readline().decode('ascii', errors='ignore').strip()
+                # Run commands queued from the GUI thread, so only this thread touches the port
+                try:
+                    cmd = self._cmd_q.get_nowait()
+                except queue.Empty:
+                    cmd = None
+                if cmd == 'read_temp':
+                    self.temperature_ready.emit(self.read_temperature())
+                
+                # Handle receive for both transmitter and receiver (for response reading).
+                # The read blocks for at most TIMEOUT and returns None when the line is idle.
+                raw = self._read_line()
+                if raw:
+                    response = raw.decode('ascii', errors='ignore').strip()
                     if response:
                         self.status_update.emit(self.device_type, f"Received: {response}")
                         
                         # Parse received LoRa packet for receiver
-                        if self.device_type == "Receiver" and "+TEST: RX" in response:
+                        match = _RX_RE.search(raw) if self.device_type == "Receiver" else None
+                        if match:
                             try:
-                                hex_data = response.split('"')[1]
-                                ascii_text = bytes.fromhex(hex_data).decode('ascii')
+                                ascii_text = bytes.fromhex(match.group(1).decode('ascii')).decode('ascii', errors='ignore')
                                 self.message_received.emit(self.device_type, f"Received message: {ascii_text}")
-                            except Exception as e:
+                            except ValueError as e:
                                 self.status_update.emit(self.device_type, f"Failed to decode message: {str(e)}")
                 
                 # Handle transmit for transmitter only
                 if self.device_type == "Transmitter":
                     current_time = time.time()
-                    if self.message_to_send and (current_time - self.last_send_time >= self.send_interval):
-                        # Convert to hex if it's not already
-                        if all(c in '0123456789ABCDEFabcdef' for c in self.message_to_send):
-                            hex_message = self.message_to_send
-                        else:
-                            hex_message = ''.join(f'{ord(c):02X}' for c in self.message_to_send)
-                            
-                        cmd = f'AT+TEST=TXLRPKT,"{hex_message}"\r\n'
-                        self.serial.write(cmd.encode())
-                        self.message_received.emit(self.device_type, f"Sent message: {self.message_to_send}")
+                    with QMutexLocker(self._tx_mutex):
+                        message, tx_command = self.message_to_send, self.tx_command
+                    if message and (current_time - self.last_send_time >= self.send_interval):
+                        self.serial.write(tx_command)
+                        self.message_received.emit(self.device_type, f"Sent message: {message}")
                         self.last_send_time = current_time
                 
-                # Don't hog the CPU
-                time.sleep(0.1)
-                
             except Exception as e:
                 self.status_update.emit(self.device_type, f"Error: {str(e)}")
                 time.sleep(1)  # Pause before trying again
@@ -252,6 +343,9 @@ class LoraTransceiverUI(QMainWindow):
         super().__init__()
         self.transmitter = None
         self.receiver = None
+        self._temp_pending = False  # a temperature read is in flight
+        self._last_sec = 0  # wall-clock second of the cached timestamp prefix
+        self._last_prefix = ''
         self.init_ui()
         
     def init_ui(self):
@@ -307,16 +401,20 @@ class LoraTransceiverUI(QMainWindow):
         # Transmitter message display
         tx_group = QGroupBox("Transmitter")
         tx_layout = QVBoxLayout()
-        self.tx_log = QTextEdit()
+        self.tx_log = QPlainTextEdit()
         self.tx_log.setReadOnly(True)
+        self.tx_log.setUndoRedoEnabled(False)
+        self.tx_log.setMaximumBlockCount(LOG_MAX_LINES)
         tx_layout.addWidget(self.tx_log)
         tx_group.setLayout(tx_layout)
         
         # Receiver message display
         rx_group = QGroupBox("Receiver")
         rx_layout = QVBoxLayout()
-        self.rx_log = QTextEdit()
+        self.rx_log = QPlainTextEdit()
         self.rx_log.setReadOnly(True)
+        self.rx_log.setUndoRedoEnabled(False)
+        self.rx_log.setMaximumBlockCount(LOG_MAX_LINES)
         rx_layout.addWidget(self.rx_log)
         rx_group.setLayout(rx_layout)
         
@@ -324,6 +422,14 @@ class LoraTransceiverUI(QMainWindow):
         splitter.addWidget(rx_group)
         main_layout.addWidget(splitter, 1)
         
+        # Pending log lines, flushed to the widgets at ~30 Hz so bursts of
+        # status updates cost one layout pass per tick instead of one per line
+        self._tx_buf = []
+        self._rx_buf = []
+        self._log_timer = QTimer(self)
+        self._log_timer.timeout.connect(self._flush_logs)
+        self._log_timer.start(33)
+        
         # Control buttons
         control_layout = QHBoxLayout()
         
@@ -392,15 +498,29 @@ class LoraTransceiverUI(QMainWindow):
     
     def log_message(self, device, message):
         """Add a timestamped message to the appropriate log"""
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+        # Format the HH:MM:SS part only once per second and append milliseconds
+        t = time.time()
+        sec = int(t)
+        if sec != self._last_sec:
+            self._last_sec = sec
+            self._last_prefix = time.strftime("%H:%M:%S", time.localtime(sec))
+        timestamp = f"{self._last_prefix}.{int((t - sec) * 1000):03d}"
         formatted_msg = f"[{timestamp}] {message}"
         
         if device == "Transmitter":
-            self.tx_log.append(formatted_msg)
-            self.tx_log.moveCursor(QTextCursor.MoveOperation.End)
+            self._tx_buf.append(formatted_msg)
         else:
-            self.rx_log.append(formatted_msg)
-            self.rx_log.moveCursor(QTextCursor.MoveOperation.End)
+            self._rx_buf.append(formatted_msg)
+    
+    def _flush_logs(self):
+        """Append buffered log lines to the log widgets in one batch"""
+        if self._tx_buf:
+            self.tx_log.appendPlainText('\n'.join(self._tx_buf))
+            self._tx_buf.clear()
+            
+        if self._rx_buf:
+            self.rx_log.appendPlainText('\n'.join(self._rx_buf))
+            self._rx_buf.clear()
     
     def update_status(self, device, message):
         """Update the status bar with a message"""
@@ -414,6 +534,7 @@ class LoraTransceiverUI(QMainWindow):
         self.transmitter.status_update.connect(self.update_status)
         self.transmitter.message_received.connect(self.log_message)
         self.transmitter.connection_status.connect(self.update_status_indicator)
+        self.transmitter.temperature_ready.connect(self.on_temperature_ready)
         self.transmitter.start()
         
         # Create and start receiver thread
@@ -440,9 +561,12 @@ class LoraTransceiverUI(QMainWindow):
         self.start_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
         self.send_btn.setEnabled(False)
+        self._temp_pending = False
         
     def clear_logs(self):
         """Clear both message logs"""
+        self._tx_buf.clear()
+        self._rx_buf.clear()
         self.tx_log.clear()
         self.rx_log.clear()
         self.log_message("System", "Logs cleared")
@@ -452,14 +576,26 @@ class LoraTransceiverUI(QMainWindow):
         if not self.transmitter or not self.transmitter.isRunning():
             self.log_message("Transmitter", "Error: Transmitter not running")
             return
+            
+        # Ignore clicks while a read is in flight so serial sessions don't overlap
+        if self._temp_pending:
+            return
+        self._temp_pending = True
+        self.send_btn.setEnabled(False)
 
         # Update UI to show we're reading temperature
         self.temp_label.setText("Temperature: Reading...")
         self.temp_label.setStyleSheet("font-weight: bold; color: orange;")
         
-        # Read the actual temperature from the device
-        temperature = self.transmitter.read_temperature()
+        # The read happens on the transmitter thread; the result arrives via temperature_ready
+        self.transmitter.request_temperature()
         
+    def on_temperature_ready(self, temperature):
+        """Handle a temperature reading completed by the transmitter thread"""
+        self._temp_pending = False
+        if self.transmitter and self.transmitter.isRunning():
+            self.send_btn.setEnabled(True)
+            
         if temperature is not None:
             # Format temperature for transmission (as a string with 2 decimal places)
             temp_str = f"{temperature:.2f}"